@@ -0,0 +1,145 @@
+# === Start Python 2/3 compatibility
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from future.builtins import *  # noqa  pylint: disable=W0401, W0614
+from future.builtins.disabled import *  # noqa  pylint: disable=W0401, W0614
+# === End Python 2/3 compatibility
+
+import errno
+import hashlib
+import os
+import tempfile
+
+from .output import out
+
+
+class ContentCache(object):
+    """A cache of text keyed by the hash of some other text.
+
+    Entries are stored as individual files so the directory can be shared
+    between checkouts, users and machines. Writes are atomic, entries are
+    readable by anyone the umask allows, and when the total size goes over
+    `max_size` the least recently used entries are removed until it is below
+    `low_water * max_size`. Failing to write to the cache is reported but
+    otherwise ignored.
+
+    Parameters
+    ----------
+    directory : string
+        Where to store the cache.
+    max_size : int
+        Maximum total size of the entries in bytes.
+    salt : string
+        Mixed into every key. Use it to describe anything other than the
+        input text that determines the output (e.g. tool versions and flags).
+    low_water : float
+        Fraction of `max_size` to shrink the cache to when it is full, so that
+        the directory only needs rescanning every so often.
+    """
+
+    def __init__(self, directory, max_size, salt='', low_water=0.9):
+
+        self.directory = directory
+        self.max_size = max_size
+        self.salt = salt
+        self.low_water = low_water
+
+        # Running estimate of the size, only rescanned when it goes over
+        self._size = self._scan()[1]
+
+        # Permissions for new entries, as a plain `open` would give
+        umask = os.umask(0)
+        os.umask(umask)
+        self._mode = 0o666 & ~umask
+
+    def _path(self, text):
+        key = hashlib.sha256((self.salt + '\0' + text).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key[:2], key)
+
+    def _scan(self):
+        # Find all the entries, and their total size
+        entries = []
+        for dirpath, _, filenames in os.walk(self.directory):
+            for name in filenames:
+                if name.startswith('.tmp'):
+                    continue  # Being written
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue  # Removed by someone else
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries, sum(e[1] for e in entries)
+
+    def get(self, text):
+        """Return the entry for text, or None if it isn't cached."""
+        path = self._path(text)
+
+        try:
+            with open(path, 'r', encoding='utf-8', newline='') as fh:
+                value = fh.read()
+        except (IOError, OSError):
+            return None
+
+        # Mark as recently used. This fails for entries owned by other users,
+        # which just makes them look older.
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        return value
+
+    def put(self, text, value):
+        """Store value as the entry for text."""
+        try:
+            self._put(text, value)
+
+            if self._size > self.max_size:
+                self._evict()
+        except (IOError, OSError) as e:
+            out.echo("Could not write to cache %s: %s" % (self.directory, e),
+                     level='summary', fg='yellow')
+            out.event('cache_error', error=str(e))
+
+    def _put(self, text, value):
+        path = self._path(text)
+
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        # Write to a temporary file and move into place so readers never see
+        # a partial entry
+        fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+        try:
+            with open(fd, 'w', encoding='utf-8', newline='') as fh:
+                fh.write(value)
+            os.chmod(tmppath, self._mode)  # mkstemp makes it private
+            os.rename(tmppath, path)
+        except (IOError, OSError):
+            try:
+                os.remove(tmppath)
+            except OSError:
+                pass
+            raise
+
+        self._size += os.path.getsize(path)
+
+    def _evict(self):
+        # Remove the oldest entries until we are comfortably under the size
+        # limit
+        entries, self._size = self._scan()
+        entries.sort()
+
+        target = self.low_water * self.max_size
+        for _, size, path in entries:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self._size -= size
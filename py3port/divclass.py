@@ -0,0 +1,155 @@
+# === Start Python 2/3 compatibility
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from future.builtins import *  # noqa  pylint: disable=W0401, W0614
+from future.builtins.disabled import *  # noqa  pylint: disable=W0401, W0614
+# === End Python 2/3 compatibility
+
+import math
+
+from . import parso_util
+
+
+def _names(node):
+    # Identifiers within a subtree
+    if node is None:
+        return []
+    return [n.value for n in parso_util.pwalk(node) if n.type == 'name']
+
+
+def _called(trailer):
+    # Name of the function called by a `(...)` trailer
+    func = trailer.get_previous_sibling()
+    if func is None:
+        return None
+    if func.type == 'trailer':
+        func = func.children[1]
+    return func.value if func.type == 'name' else None
+
+
+def features(node):
+    """Describe the context of a division operator.
+
+    Parameters
+    ----------
+    node : parso leaf
+        The `/` operator.
+
+    Returns
+    -------
+    features : set of strings
+        Names of the operands (`left:`/`right:`), the leaves either side of
+        the operator (`prev:`/`next:`), the enclosing function (`func:`),
+        the variables assigned to (`target:`) and whether the division is
+        within an index or slice (`ctx:`), a call (`call:`), or a keyword
+        argument (`kwarg:`).
+    """
+
+    feats = set()
+
+    feats.update('left:' + n for n in _names(node.get_previous_sibling()))
+    feats.update('right:' + n for n in _names(node.get_next_sibling()))
+
+    prev_leaf = node.get_previous_leaf()
+    next_leaf = node.get_next_leaf()
+    if prev_leaf is not None:
+        feats.add('prev:' + prev_leaf.value)
+    if next_leaf is not None:
+        feats.add('next:' + next_leaf.value)
+
+    # Look at the expressions (and function) that contain the division
+    ancestor = node.parent
+    while ancestor is not None:
+
+        if ancestor.type == 'funcdef':
+            feats.add('func:' + ancestor.children[1].value)
+            break
+
+        elif ancestor.type == 'subscript':
+            feats.add('ctx:slice')
+
+        elif ancestor.type == 'trailer' and ancestor.children[0].value == '[':
+            feats.add('ctx:index')
+
+        elif ancestor.type == 'trailer' and ancestor.children[0].value == '(':
+            called = _called(ancestor)
+            if called:
+                feats.add('call:' + called)
+
+        elif ancestor.type == 'argument' and ancestor.children[0].type == 'name':
+            feats.add('kwarg:' + ancestor.children[0].value)
+
+        elif ancestor.type == 'expr_stmt':
+            feats.update('target:' + n for n in _names(ancestor.children[0]))
+
+        ancestor = ancestor.parent
+
+    return feats
+
+
+class DivisionClassifier(object):
+    """Learn from the answers given which type of division is wanted.
+
+    A Bernoulli naive Bayes classifier over the `features` of each division.
+    It starts with no knowledge and only makes predictions once it has seen a
+    few answers, including at least one of each type. Its confidence is
+    capped by how many answers of the rarer type it has seen.
+
+    Parameters
+    ----------
+    min_examples : int
+        Number of answers needed before making any predictions.
+    """
+
+    def __init__(self, min_examples=5):
+
+        self.min_examples = min_examples
+
+        self.counts = {'F': {}, 'I': {}}
+        self.totals = {'F': 0, 'I': 0}
+
+    def learn(self, feats, answer):
+        """Add the answer given for a division with the given features."""
+        self.totals[answer] += 1
+        counts = self.counts[answer]
+        for f in feats:
+            counts[f] = counts.get(f, 0) + 1
+
+    def predict(self, feats):
+        """Predict the answer for a division.
+
+        Returns
+        -------
+        answer : string
+            `F` or `I`, or None if we haven't seen enough examples (or only
+            examples of one type).
+        confidence : float
+            Estimated probability that the answer is correct.
+        """
+        n = sum(self.totals.values())
+        fewest = min(self.totals.values())
+        if n < self.min_examples or fewest == 0:
+            return None, 0.0
+
+        # Log probabilities with Laplace smoothing. Features never seen in
+        # training say nothing about the answer, so only those that have been
+        # seen are used, counting both their presence and absence.
+        vocab = set(self.counts['F']) | set(self.counts['I'])
+        scores = {}
+        for answer, total in self.totals.items():
+            counts = self.counts[answer]
+            score = math.log((total + 1.0) / (n + 2.0))
+            for f in vocab:
+                p = (counts.get(f, 0) + 1.0) / (total + 2.0)
+                score += math.log(p if f in feats else 1.0 - p)
+            scores[answer] = score
+
+        best = max(scores, key=scores.get)
+        other = 'I' if best == 'F' else 'F'
+        confidence = 1.0 / (1.0 + math.exp(scores[other] - scores[best]))
+
+        # Don't claim more certainty than the answers of the rarer type
+        # justify, e.g. at most 6/7 after five of them
+        confidence = min(confidence, (fewest + 1.0) / (fewest + 2.0))
+
+        return best, confidence
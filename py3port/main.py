@@ -5,18 +5,62 @@ from future.builtins import *  # noqa  pylint: disable=W0401, W0614
 from future.builtins.disabled import *  # noqa  pylint: disable=W0401, W0614
 # === End Python 2/3 compatibility
 
-import subprocess
+import collections
+import difflib
 import os
+import sys
+import time
 import parso
 import click
 
+from lib2to3 import refactor
+from libfuturize.fixes import (lib2to3_fix_names_stage1,
+                               lib2to3_fix_names_stage2,
+                               libfuturize_fix_names_stage1,
+                               libfuturize_fix_names_stage2)
+import future
+
+from . import cache
+from . import divclass
 from . import parso_util
+from . import progress
+from . import shard as shard_util
+from . import testrun
+from . import output
+from .output import out
 
 # Disable warning.
 click.disable_unicode_literals_warning = True
 
+
+# The fixers run by `futurize -0 -u -x libfuturize.fixes.fix_division_safe`
+FUTURIZE_FIXERS = sorted(
+    (set(lib2to3_fix_names_stage1) | set(libfuturize_fix_names_stage1) |
+     set(lib2to3_fix_names_stage2) | set(libfuturize_fix_names_stage2) |
+     {'libfuturize.fixes.fix_unicode_literals_import'}) -
+    {'libfuturize.fixes.fix_division_safe'}
+)
+
+PROCESSED_MARKER = "# === Start Python 2/3 compatibility"
+
+
+class Change(collections.namedtuple('Change', ['kind', 'line', 'column', 'old', 'new'])):
+    """A modification made when porting.
+
+    `old` and `new` are the text before and after (None where that doesn't
+    make sense, e.g. for the block of imports).
+    """
+    __slots__ = ()
+
+
+def _changed(changes, kind, node, old=None, new=None, start_pos=None):
+    # Note a change to node (or at start_pos), both in the list and the output
+    line, column = start_pos or node.start_pos
+    changes.append(Change(kind, line, column, old, new))
+    out.event(kind, line=line, old=old, new=new)
+
 def context_tree(node, filename, num=3, style=None):
-    """Print some context around node.
+    """Render some context around node.
 
     Parameters
     ----------
@@ -28,7 +72,13 @@ def context_tree(node, filename, num=3, style=None):
         Number of lines of context.
     style : dict
         Styling of nodes. Should be a mapping from parso node to a dictionary
-        of parameters given to `click.style`.
+        of parameters given to `click.style`. Only used if the output is
+        coloured.
+
+    Returns
+    -------
+    text : string
+        The context with a header line.
     """
 
 
@@ -44,165 +94,242 @@ def context_tree(node, filename, num=3, style=None):
     while print_node.line > start_line:
         print_node = print_node.get_previous_leaf()
 
-    # Printer header
-    click.secho("==== %s : %i ====" % (filename, lineno))
+    # Header
+    text = ["==== %s : %i ====\n" % (filename, lineno)]
 
-    # Print (styled) nodes until we reach either the end of file, or have printed enough lines
+    # Add (styled) nodes until we reach either the end of file, or have printed enough lines
     while print_node.type != 'endmarker' and print_node.line < lineno + num:
-        node_style = style_dict[parso_util.find_ancestor(print_node, style_dict.keys())]
-        click.echo(click.style(print_node.get_code(), **node_style), nl=False)
+        code = print_node.get_code()
+        if out.color:
+            node_style = style_dict[parso_util.find_ancestor(print_node, style_dict.keys())]
+            code = click.style(code, **node_style)
+        text.append(code)
         print_node = print_node.get_next_leaf()
 
+    return ''.join(text)
 
 
-def process_div(tree, filename):
-    """Find division operators, prompt for transform, and modify tree.
+def prompt_division(node, filename, suggestion=None):
+    """Show the context of a division and ask the user what type it is.
 
-    Detect any trivial float divisions (and preserve them). Any others are
-    prompted to see which type they should be.
+    Parameters
+    ----------
+    node : parso leaf
+        The division operator.
+    filename : string
+        Name of the file it is in.
+    suggestion : tuple, optional
+        A suggested `(answer, confidence)`, which is accepted by pressing
+        Enter.
+
+    Returns
+    -------
+    div_type : string
+        Either `F` for floating point or `I` for integer division.
     """
-    for node in parso_util.pwalk(tree):
-        if node.type == 'operator' and node.value == '/':
-
-            # Print out the context around the operator
-            click.clear()
-            context_tree(
-                node, filename, num=8,
-                style={
-                    node: {'fg':'red'},
-                    node.parent: {'fg': 'bright_white', 'bold': True}
-                }
-            )
-            click.echo()
-
-
-            left_term = node.get_previous_sibling()
-            right_term = node.get_next_sibling()
-            if (parso_util.is_float_walk(left_term) or
-                    parso_util.is_float_walk(right_term)):
-                click.echo("Found trivial float division\n")
-                continue
 
-            click.echo("Options:")
-            click.echo("[F]: Floating point division")
-            click.echo("[I]: Integer division using the floor division operator")
-            div_type = click.prompt("Division type?", type=click.Choice(["F", "I"], case_sensitive=False))
+    # Keep the prompts out of the way of JSON output on stdout
+    err = out.err or out.level == 'json'
 
-            if div_type.lower() == 'i':
-                node.value = '//'
+    # Print out the context around the operator
+    out.flush()
+    if not err:
+        click.clear()
+    click.echo(context_tree(
+        node, filename, num=8,
+        style={
+            node: {'fg':'red'},
+            node.parent: {'fg': 'bright_white', 'bold': True}
+        }
+    ), nl=False, err=err)
+    click.echo(err=err)
 
+    click.echo("Options:", err=err)
+    click.echo("[F]: Floating point division", err=err)
+    click.echo("[I]: Integer division using the floor division operator", err=err)
 
-def process_iterview(tree, filename):
-    """Find items/keys/values that can be used in an iterator context.
+    default = None
+    if suggestion is not None:
+        default = suggestion[0]
+        click.echo("Suggested: %s (%.0f%% confident)" % (default, 100 * suggestion[1]),
+                   err=err)
 
-    This replaces them with the viewitems versions which are correctly
-    processed by futurize. Only does anything within the target of a for loop
-    and in list/dict comprehensions.
+    div_type = click.prompt("Division type?", default=default, err=err,
+                            type=click.Choice(["F", "I"], case_sensitive=False))
+
+    return div_type.upper()
+
+
+def learning_decide(interactive, classifier, auto_threshold=None):
+    """Make a `decide` function which learns from the answers given.
+
+    Parameters
+    ----------
+    interactive : function
+        Asks the user, called as `interactive(node, filename, suggestion=...)`
+        (see `prompt_division`).
+    classifier : divclass.DivisionClassifier
+        Learns from each answer and suggests the next.
+    auto_threshold : float, optional
+        If the classifier is at least this confident, use its answer without
+        asking.
     """
-    transform_dict = {
-        'items': 'viewitems',
-        'iteritems': 'viewitems',
-        'keys': 'viewkeys',
-        'iterkeys': 'viewkeys',
-        'values': 'viewvalues',
-        'itervalues': 'viewvalues'
-    }
-
-    # Find item and iteritems calls in for loops, and list,dict comprehensions
-    for node in parso_util.pwalk(tree):
-        if node.type in ['for_stmt', 'comp_for']:
-            iterable = parso_util.augment(node.children[3])
-
-            if not (isinstance(iterable, parso_util.FuncCall) and
-                    isinstance(iterable.func, parso_util.Attribute)):
-                continue
 
-            last_call = iterable.func.attr
+    def decide(node, filename):
+        feats = divclass.features(node)
+        guess, confidence = classifier.predict(feats)
 
-            if not last_call.value in transform_dict:
-                continue
+        if guess is not None and auto_threshold is not None and confidence >= auto_threshold:
+            out.echo("Using %s division at line %i (%.0f%% confident)" %
+                     (guess, node.line, 100 * confidence))
+            out.event('auto_div', line=node.line, answer=guess, confidence=confidence)
+            return guess
 
-            last_call.value = transform_dict[last_call.value]
+        answer = interactive(node, filename,
+                             suggestion=(guess, confidence) if guess is not None else None)
+        classifier.learn(feats, answer)
+        return answer
 
-            context_tree(
-                node, filename, num=4,
-                style={
-                    last_call: {'fg':'red'},
-                    iterable.node: {'fg': 'bright_white', 'bold': True}
-                }
-            )
+    return decide
 
 
-def process_inkeys(tree, filename):
-    """Fix the in .keys() anti-pattern
+def fix_div(node, filename, changes, decide=prompt_division):
+    """Decide on the type of a division operator, and modify it.
 
-    Not strictly a Python 2->3 issue, but it does make the code uglier once
-    converted.
+    Trivial float divisions are preserved. For any others `decide(node,
+    filename)` is called to see which type they should be (by default this
+    prompts the user).
     """
-    for node in parso_util.pwalk(tree):
-        if node.type != 'comparison':
-            continue
 
-        comp_op = node.children[1]
+    left_term = node.get_previous_sibling()
+    right_term = node.get_next_sibling()
+    if (parso_util.is_float_walk(left_term) or
+            parso_util.is_float_walk(right_term)):
+        out.echo("Found trivial float division at line %i" % node.line)
+        out.event('trivial_div', line=node.line)
+        return
 
-        if not ((comp_op.type == 'keyword' and comp_op.value == 'in') or
-                (comp_op.type == 'comp_op' and
-                 comp_op.children[1].type == 'keyword' and
-                 comp_op.children[1].value == 'in')):
-            continue
+    div_type = decide(node, filename)
+    _changed(changes, 'div', node, '/', '//' if div_type == 'I' else '/')
 
-        target = parso_util.augment(node.children[2])
+    if div_type == 'I':
+        node.value = '//'
 
-        if not (isinstance(target, parso_util.FuncCall) and
-                isinstance(target.func, parso_util.Attribute)):
-            continue
 
-        last_call = target.func.attr
+_ITERVIEWS = {
+    'items': 'viewitems',
+    'iteritems': 'viewitems',
+    'keys': 'viewkeys',
+    'iterkeys': 'viewkeys',
+    'values': 'viewvalues',
+    'itervalues': 'viewvalues'
+}
 
-        if last_call.value != 'keys':
-            continue
 
-        new_target = parso_util.trim_power(parso_util.trim_power(target.node, node), node)
-        if isinstance(new_target, parso_util.TempNode):
-            new_target = new_target.full()
+def fix_iterview(node, filename, changes, decide=None):
+    """Use an items/keys/values view as the target of a for loop.
+
+    This replaces them with the viewitems versions which are correctly
+    processed by futurize. Only used for the target of a for loop and in
+    list/dict comprehensions.
+    """
+    iterable = node.children[3]
+    last_call = iterable.children[-2].children[1]
+
+    _changed(changes, 'iterview', last_call, last_call.value,
+             _ITERVIEWS[last_call.value])
+    last_call.value = _ITERVIEWS[last_call.value]
+
+    if out.level == 'normal':
+        out.echo(context_tree(
+            node, filename, num=4,
+            style={
+                last_call: {'fg':'red'},
+                iterable: {'fg': 'bright_white', 'bold': True}
+            }
+        ), nl=False)
+
+
+def fix_inkeys(node, filename, changes, decide=None):
+    """Fix the in .keys() anti-pattern
+
+    Not strictly a Python 2->3 issue, but it does make the code uglier once
+    converted.
+    """
+    target = node.children[2]
 
-        node.children[2] = new_target
-        new_target.parent = node
+    new_target = parso_util.trim_power(parso_util.trim_power(target, node), node)
+    if isinstance(new_target, parso_util.TempNode):
+        new_target = new_target.full()
 
-    click.secho("Fixing 'a in x.keys()' antipattern.", bold=True)
-    click.echo("\n\n")
+    old = target.get_code()
+    node.children[2] = new_target
+    new_target.parent = node
+    _changed(changes, 'inkeys', node, old, new_target.get_code())
 
 
-def process_octal(tree, filename):
+def fix_octal(node, filename, changes, decide=None):
     """Remove unnecessary octal literals.
 
     There's a bunch of octal numbers that creep in from people trying to
     zero pad integers (WRONG!) in datetimes. This gets rid of them.
     """
-    for node in parso_util.pwalk(tree):
-        if node.type != 'number':
-            continue
-
-        # Check if is an octal number
-        if not (len(node.value) > 1 and '.' not in node.value and
-                node.value[0] == '0'):
-            continue
 
-        context_tree(
+    if out.level == 'normal':
+        out.echo(context_tree(
             node, filename, num=2,
             style={
                 node: {'fg':'red'},
                 node.parent: {'fg': 'bright_white', 'bold': True}
             }
-        )
-
-        if node.parent.type == 'arglist':
-            func = node.parent.parent.get_previous_sibling()
-            func = func.children[1] if func.type == 'trailer' else func
-
-            if func.value in ['datetime', 'date']:
-                click.echo("Correcting octal number within datetime\n")
-                node.value = node.value[1:]
+        ), nl=False)
+
+    if node.parent.type == 'arglist':
+        func = node.parent.parent.get_previous_sibling()
+        func = func.children[1] if func.type == 'trailer' else func
+
+        if func.value in ['datetime', 'date']:
+            out.echo("Correcting octal number within datetime\n")
+            _changed(changes, 'octal', node, node.value, node.value[1:])
+            node.value = node.value[1:]
+
+
+def _method_call(names, argument=None):
+    # A call of a method with one of the given names, e.g. `x.keys()`, and
+    # optionally a single argument
+    if argument is None:
+        call = parso_util.Pattern('trailer', children={
+            0: parso_util.Op('('), -1: parso_util.Op(')')})
+    else:
+        call = parso_util.Pattern('trailer', num_children=3, children={
+            0: parso_util.Op('('), 1: argument, 2: parso_util.Op(')')})
+
+    return parso_util.Pattern('power', min_children=3, children={
+        -2: parso_util.Pattern('trailer', children={
+            0: parso_util.Op('.'), 1: parso_util.Pattern('name', names)}),
+        -1: call
+    })
+
+
+def _is_octal(node):
+    return len(node.value) > 1 and '.' not in node.value and node.value[0] == '0'
+
+
+# The transformations done by `preprocess`, all found in a single walk of the
+# tree. Each is called as `fix(node, filename, changes, decide)`.
+_preprocess_fixes = parso_util.PatternSet()
+_preprocess_fixes.register(parso_util.Op('/'), fix_div)
+_preprocess_fixes.register(parso_util.Pattern('comparison', children={
+    1: parso_util.AnyOf(
+        parso_util.Pattern('keyword', 'in'),
+        parso_util.Pattern('comp_op', children={1: parso_util.Pattern('keyword', 'in')})
+    ),
+    2: _method_call('keys')
+}), fix_inkeys)
+_preprocess_fixes.register(parso_util.Pattern(['for_stmt', 'comp_for'], children={
+    3: _method_call(list(_ITERVIEWS))
+}), fix_iterview)
+_preprocess_fixes.register(parso_util.Pattern('number', test=_is_octal), fix_octal)
 
 
 def process_imports(tree, filename):
@@ -241,6 +368,10 @@ from future.builtins.disabled import *  # noqa  pylint: disable=W0401, W0614
 
     pos = 1 if has_docstring(tree) else 0
 
+    # Line the imports go in at, i.e. the start of the file or just after the
+    # docstring
+    line = tree.children[0].end_pos[0] if pos else 1
+
     import_tree = parso.parse(import_txt)
 
     for oi, stmt in enumerate(import_tree.children):
@@ -253,142 +384,426 @@ from future.builtins.disabled import *  # noqa  pylint: disable=W0401, W0614
         leaf0 = tree.children[0].get_first_leaf()
         leaf0.prefix = orig_first.get_first_leaf().prefix + leaf0.prefix
 
-    click.secho("Adding imports.", bold=True)
-    click.echo("\n\n")
+    out.echo("Adding imports.", bold=True)
+    out.echo("\n\n")
 
+    changes = []
+    _changed(changes, 'imports', None, start_pos=(line, 0))
+    return changes
 
-def process_int(tree, filename):
+
+def fix_int(node, filename, changes):
     """Replace `int` when used as a datatype.
 
     Because of the overriden builtin we can't use `int` as a datatype
     argument for numpy (and we should probably never have been doing so).
-    This function replaces them with `np.int`.V
+    This replaces it with `np.int` in a `dtype=int` argument or `astype(int)`.
+    """
+    if node.type == 'argument':
+        name = node.children[2]
+    else:
+        name = node.children[-1].children[1]
+
+    _changed(changes, 'int', name, 'int', 'np.int')
+    name.value = 'np.int'
+
+
+# The transformations done by `postprocess`, called as `fix(node, filename,
+# changes)`
+_postprocess_fixes = parso_util.PatternSet()
+_postprocess_fixes.register(parso_util.Pattern('argument', num_children=3, children={
+    0: parso_util.Pattern('name', 'dtype'),
+    1: parso_util.Op('='),
+    2: parso_util.Pattern('name', 'int')
+}), fix_int)
+_postprocess_fixes.register(_method_call('astype', parso_util.Pattern('name', 'int')), fix_int)
+
+
+def preprocess(source, filename='<string>', decide=prompt_division):
+    """Transformations before futurize called.
+
+    Returns
+    -------
+    tree : parso module
+        Tree of the transformed code. Pass this to `postprocess` so it can
+        avoid reparsing the code that futurize doesn't change.
+    changes : list of Change
+        The modifications made.
     """
 
-    for node in parso_util.pwalk(tree):
+    tree = parso.parse(source, version='2.7')
 
-        # Find all uses of `int`
-        if not (node.type == 'name' and node.value == 'int'):
-            continue
+    if tree.children[0].type == 'endmarker':
+        return tree, []
 
-        # Replace where used as a dtype=int keyword argument
-        if (node.parent.type == 'argument' and
-                node.get_previous_sibling().type == 'operator' and
-                node.get_previous_sibling().value == '=' and
-                node.parent.children[0].type == 'name' and
-                node.parent.children[0].value == 'dtype'):
-            node.value = 'np.int'
+    changes = []
+    for node, fix in _preprocess_fixes.find(tree):
+        fix(node, filename, changes, decide)
 
-        # Replace where used solely in an astype
-        elif (node.parent.type == 'trailer' and
-              node.get_previous_sibling().type == 'operator'):
+    out.echo("Fixing 'a in x.keys()' antipattern.", bold=True)
+    out.echo("\n\n")
 
-            func = parso_util.augment(node.parent.parent)
+    return tree, changes
 
-            if not (isinstance(func, parso_util.FuncCall) and
-                    isinstance(func.func, parso_util.Attribute)):
-                continue
 
-            last_call = func.func.attr
+_refactoring_tool = None
 
-            if last_call.value != 'astype':
-                continue
+# Set to a `cache.ContentCache` to reuse the output of futurize
+futurize_cache = None
 
-            node.value = 'np.int'
 
+def make_futurize_cache(directory, max_size):
+    """Create a cache for the output of futurize.
 
-def preprocess(filename):
-    """Transformations before futurize called."""
+    Entries are keyed on the source, the versions of future and of Python
+    (whose lib2to3 does the work), and the fixers used, so the directory can be
+    safely shared between checkouts and machines.
+    """
+    salt = "futurize %s python %i.%i %s" % (future.__version__, sys.version_info[0],
+                                            sys.version_info[1], " ".join(FUTURIZE_FIXERS))
+    return cache.ContentCache(directory, max_size, salt=salt)
 
-    with open(filename, 'r') as fh:
-        tree = parso.parse(fh.read(), version='2.7')
 
-    if tree.children[0].type == 'endmarker':
-        return
+def futurize(source, filename='<string>'):
+    """Run the futurize fixers over source.
 
-    process_div(tree, filename)
-    process_inkeys(tree, filename)
-    process_iterview(tree, filename)
-    process_octal(tree, filename)
+    This is equivalent to `futurize -0 -u -x
+    libfuturize.fixes.fix_division_safe`, but done in process and without
+    touching the disk (except for `futurize_cache` if it is set).
+    """
+    global _refactoring_tool
 
-    with open(filename, 'w') as fh:
-        fh.write(tree.get_code())
+    if futurize_cache is not None:
+        cached = futurize_cache.get(source)
+        if cached is not None:
+            out.echo("Using cached output.")
+            return cached
 
+    if _refactoring_tool is None:
+        _refactoring_tool = refactor.RefactoringTool(FUTURIZE_FIXERS, {}, [])
 
-def postprocess(filename):
-    """Transformations after futurize called."""
+    # Like lib2to3's `refactor_file`, add a newline to avoid parse errors at
+    # the end of the file, and take it off again afterwards
+    result = str(_refactoring_tool.refactor_string(source + '\n', filename))[:-1]
 
-    with open(filename, 'r') as fh:
-        tree = parso.parse(fh.read(), version='2.7')
+    if futurize_cache is not None:
+        futurize_cache.put(source, result)
+
+    return result
+
+
+def postprocess(source, filename='<string>', base=None):
+    """Transformations after futurize called.
+
+    If the `base` tree from `preprocess` is given, only the parts of source
+    that differ from it are parsed. The base tree is consumed in the process.
+
+    Returns
+    -------
+    source : string
+        The transformed code.
+    changes : list of Change
+        The modifications made.
+    """
+
+    if base is not None:
+        tree = parso_util.reparse(base, source, version='2.7')
+    else:
+        tree = parso.parse(source, version='2.7')
 
     if tree.children[0].type == 'endmarker':
-        return
+        return source, []
 
-    process_imports(tree, filename)
-    process_int(tree, filename)
+    changes = process_imports(tree, filename)
+    for node, fix in _postprocess_fixes.find(tree):
+        fix(node, filename, changes)
 
-    with open(filename, 'w') as fh:
-        fh.write(tree.get_code())
+    return tree.get_code(), changes
 
 
-def already_processed(filename):
-    """Return True if filename has already been processed.
+def port_source(source, decide=prompt_division, filename='<string>'):
+    """Port Python 2 code held in memory.
 
-    Checks for the presence of the future import block.
+    Parameters
+    ----------
+    source : string
+        Code to port.
+    decide : function, optional
+        Called as `decide(node, filename)` for every division that isn't
+        trivially floating point, and should return `F` to keep it as a float
+        division, or `I` to turn it into a floor division. The default prompts
+        the user.
+    filename : string, optional
+        Name to use for the code in any messages.
+
+    Returns
+    -------
+    ported : string
+        The ported code. Unchanged if it has already been processed.
+    changes : list of Change
+        Modifications made by py3port itself (i.e. excluding those made by
+        futurize).
     """
-    test_code = "# === Start Python 2/3 compatibility"
 
-    with open(filename, 'r') as fh:
-        src = fh.read()
+    out.start(filename)
+
+    if PROCESSED_MARKER in source:
+        out.finish('skipped')
+        return source, []
 
-        return test_code in src
+    tree, pre_changes = preprocess(source, filename, decide)
+    source = futurize(tree.get_code(), filename)
+    source, post_changes = postprocess(source, filename, base=tree)
 
+    out.finish('ported')
+    return source, pre_changes + post_changes
 
-def process(filename):
+
+def process(filename, decide=prompt_division):
     """Port a file.
+
+    Returns
+    -------
+    record : dict
+        Summary of the run on this file: its `status`, the time spent in
+        each stage (`timings`) and the division `decisions` made.
     """
 
-    click.secho("########## %s ###########" % filename, bold=True)
+    record = {'file': os.path.normpath(filename), 'status': 'skipped',
+              'timings': {}, 'decisions': []}
 
-    if already_processed(filename):
-        click.secho("File already processed. Skipping...")
-        return
+    out.start(filename)
+    out.echo("########## %s ###########" % filename, bold=True)
+
+    with open(filename, 'r') as fh:
+        source = fh.read()
+
+    if PROCESSED_MARKER in source:
+        out.echo("File already processed. Skipping...")
+        out.finish(record['status'])
+        return record
+
+    out.echo("Preprocessing:")
+    t0 = time.time()
+    tree, changes = preprocess(source, filename, decide)
+    pre_source = tree.get_code()
+    record['timings']['preprocess'] = time.time() - t0
+
+    out.echo("Calling futurize:")
+    t0 = time.time()
+    new_source = futurize(pre_source, filename)
+    if out.level == 'normal':
+        out.echo(''.join(difflib.unified_diff(
+            pre_source.splitlines(True), new_source.splitlines(True),
+            filename + ' (original)', filename + ' (refactored)'
+        )), nl=False)
+    record['timings']['futurize'] = time.time() - t0
+
+    out.echo("Post processing:")
+    t0 = time.time()
+    new_source, post_changes = postprocess(new_source, filename, base=tree)
+    changes += post_changes
+    record['timings']['postprocess'] = time.time() - t0
+
+    with open(filename, 'w') as fh:
+        fh.write(new_source)
 
-    click.secho("Preprocessing:")
-    preprocess(filename)
+    record['decisions'] = [(c.line, c.column, 'I' if c.new == '//' else 'F')
+                           for c in changes if c.kind == 'div']
+    record['status'] = 'ported'
+    out.finish(record['status'])
+    return record
+
+
+def find_files(root='.'):
+    """Find all Python files beneath root."""
+    files = []
+
+    for dirpath, _, filenames in os.walk(root):
+
+        for name in filenames:
+
+            if not os.path.splitext(name)[1] == '.py':
+                continue
 
-    # Call futurize
-    click.secho("Calling futurize:")
-    call = ("futurize -0 -u -x libfuturize.fixes.fix_division_safe -w %s" %
-            filename)
-    subprocess.check_call(call.split())
+            files.append(os.path.join(dirpath, name))
 
-    click.secho("Post processing:")
-    postprocess(filename)
+    return files
+
+
+def _shard_option(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return shard_util.parse_shard(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def _test_python_option(ctx, param, value):
+    for interp in value:
+        if not testrun.is_executable(interp):
+            raise click.BadParameter("Can't find interpreter %r" % interp)
+    return value
 
 
 @click.command()
 @click.argument('files', nargs=-1)
-def main(files):
+@click.option('--shard', metavar='K/N', callback=_shard_option,
+              help="Only process the K-th of N deterministic shards of FILES.")
+@click.option('--manifest', type=click.Path(file_okay=False),
+              help="Shared directory used to hand out files between nodes "
+                   "and to collect a record of each file processed.")
+@click.option('--merge', is_flag=True,
+              help="Combine the node records within --manifest and exit.")
+@click.option('--test-python', 'test_pythons', multiple=True, metavar='INTERP',
+              callback=_test_python_option,
+              help="After porting each file run the tests that import it "
+                   "with this interpreter. Can be given multiple times.")
+@click.option('--test-jobs', type=click.IntRange(1), default=1, show_default=True,
+              help="Number of test runs to have going at once.")
+@click.option('--output', 'output_level', default='normal', show_default=True,
+              type=click.Choice(output.LEVELS),
+              help="How much to report: `quiet` only prompts and errors, "
+                   "`summary` a line per file, `normal` everything and `json` "
+                   "a JSON object per line for each change.")
+@click.option('--color/--no-color', default=None,
+              help="Style the output. Default is to only do so on a terminal.")
+@click.option('--division', default='ask', show_default=True,
+              type=click.Choice(['ask', 'float', 'floor']),
+              help="How to treat non-trivial divisions. By default ask each time.")
+@click.option('--cache-dir', type=click.Path(file_okay=False),
+              envvar='PY3PORT_CACHE_DIR',
+              help="Directory in which to cache the output of futurize. Can be "
+                   "shared between checkouts.")
+@click.option('--cache-size', type=int, default=500, show_default=True,
+              help="Maximum size of the cache in MB.")
+@click.option('--progress-file', type=click.Path(dir_okay=False),
+              help="Periodically write the progress of the run to this file "
+                   "as JSON.")
+@click.option('--auto-division', type=click.FloatRange(0.5, 1.0), metavar='CONFIDENCE',
+              help="Stop asking about divisions when the answer learned from "
+                   "earlier ones is at least this likely to be right.")
+def main(files, shard, manifest, merge, test_pythons, test_jobs,
+         output_level, color, division, cache_dir, cache_size, progress_file,
+         auto_division):
     """Port code to Python 3 using python-future to maintain Python 2 support.
 
     Processes the given FILES. If FILES not set, then it will process all
-    Python files beneath the current location.'
+    Python files beneath the current location.' If FILES is `-` then read
+    code from stdin and write the ported version to stdout (this requires
+    --division to be set).
+
+    To split a run across several machines sharing a filesystem either give
+    each a distinct --shard, or point them all at the same --manifest
+    directory, in which case each file is claimed by whichever node gets to
+    it first. Run with --merge afterwards to combine the records.
+
+    With --test-python the tests affected by each file are run in the
+    background as soon as it has been ported, so breakages are found early.
+    Tests are discovered from files named `test_*.py` or `*_test.py` beneath
+    the current location.
+
+    When asking about divisions, the answers given so far are used to
+    suggest the next one, which can be accepted by pressing Enter. With
+    --auto-division confident suggestions are used without asking.
     """
+    filter_mode = files == ('-',)
+    out.configure(level=output_level, color=color, err=filter_mode)
+
+    decide = {
+        'ask': prompt_division,
+        'float': lambda node, filename: 'F',
+        'floor': lambda node, filename: 'I',
+    }[division]
+
+    if cache_dir is not None:
+        global futurize_cache
+        futurize_cache = make_futurize_cache(cache_dir, cache_size * 2**20)
+
+    if filter_mode:
+        if division == 'ask':
+            raise click.UsageError("Can't prompt when reading from stdin, set --division")
+
+        source = click.get_text_stream('stdin').read()
+        ported, _ = port_source(source, decide, filename='<stdin>')
+        click.get_text_stream('stdout').write(ported)
+        return
+
+    if merge:
+        if manifest is None:
+            raise click.UsageError("--merge requires --manifest")
+
+        summary = shard_util.merge_records(manifest)
+        for node, entry in sorted(summary.items()):
+            timings = ", ".join("%s %.1fs" % st for st in sorted(entry['timings'].items()))
+            click.echo("%s: %i files (%s)" % (node, entry['files'], timings))
+            for filename, error in entry['failed']:
+                click.echo("  failed: %s: %s" % (filename, error))
+        return
+
     if not len(files):
-        files = []
+        files = find_files()
 
-        for dirpath, _, filenames in os.walk('.'):
+    runner = None
+    if test_pythons:
+        graph = testrun.ImportGraph(find_files())
+        runner = testrun.TestRunner(test_pythons, jobs=test_jobs)
 
-            for name in filenames:
+    if shard is not None:
+        files = shard_util.shard_files(files, *shard)
 
-                if not os.path.splitext(name)[1] == '.py':
-                    continue
+    if manifest is not None:
+        node = shard_util.node_name()
+        shard_util.init_manifest(manifest)
 
-                files.append(os.path.join(dirpath, name))
+    tracker = progress.Progress(len(files), snapshot=progress_file)
+    if division == 'ask':
+        decide = learning_decide(tracker.timed(prompt_division),
+                                 divclass.DivisionClassifier(),
+                                 auto_threshold=auto_division)
 
     for filename in files:
-        process(filename)
+
+        if manifest is not None and not shard_util.claim(manifest, filename, node):
+            tracker.finish()
+            continue
+
+        try:
+            record = process(filename, decide)
+        except KeyboardInterrupt:
+            # Leave the file for another run
+            if manifest is not None:
+                shard_util.release(manifest, filename)
+            raise
+        except Exception as e:
+            # Record the failure, release the file so a later run can retry it,
+            # and carry on with the rest
+            record = {'file': os.path.normpath(filename), 'status': 'failed',
+                      'error': repr(e), 'timings': {}, 'decisions': []}
+            out.echo("Could not port %s: %r" % (filename, e), level='quiet', fg='red')
+            out.event('error', error=repr(e))
+            out.finish(record['status'])
+            if manifest is not None:
+                shard_util.release(manifest, filename)
+
+        tracker.finish(record)
+        out.status(tracker.line())
+        tracker.write_snapshot()
+
+        if manifest is not None:
+            shard_util.write_record(manifest, node, record)
+
+        if runner is not None:
+            if record['status'] == 'ported':
+                runner.submit(filename, graph.affected_tests(filename))
+            runner.poll()
+
+    tracker.write_snapshot(force=True)
+    out.end_status()
+
+    if runner is not None:
+        runner.wait()
 
 
 if __name__ == '__main__':
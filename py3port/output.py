@@ -0,0 +1,153 @@
+# === Start Python 2/3 compatibility
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from future.builtins import *  # noqa  pylint: disable=W0401, W0614
+from future.builtins.disabled import *  # noqa  pylint: disable=W0401, W0614
+# === End Python 2/3 compatibility
+
+import json
+import sys
+
+import click
+
+
+LEVELS = ['quiet', 'summary', 'normal', 'json']
+
+
+class Output(object):
+    """Buffered writer for everything py3port reports.
+
+    Output for each file is gathered up and written in a single go when the
+    file is finished (or when we need to prompt the user), and styling is only
+    applied when writing to a terminal.
+
+    Parameters
+    ----------
+    level : string
+        One of `quiet` (only prompts and test failures), `summary` (a line per file),
+        `normal` (everything) or `json` (a JSON object per line for each
+        change made).
+    color : bool, optional
+        Whether to style the output. By default only if writing to a terminal.
+    err : bool
+        Write to stderr rather than stdout.
+    """
+
+    def __init__(self, level='normal', color=None, err=False):
+        self.configure(level, color, err)
+
+        self._buffer = []
+        self._filename = None
+        self._counts = {}
+        self._status = False
+
+    def configure(self, level='normal', color=None, err=False):
+        """Change the settings. Parameters as for the constructor."""
+        if level not in LEVELS:
+            raise ValueError("Unknown output level %r" % level)
+
+        self.level = level
+        self.err = err
+
+        stream = sys.stderr if err else sys.stdout
+        self.tty = stream.isatty()
+        self.color = self.tty if color is None else color
+
+    def _shown(self, level):
+        return (self.level != 'json' and
+                LEVELS.index(self.level) >= LEVELS.index(level))
+
+    def style(self, text, **styles):
+        """Style text with `click.style` if we are using colour."""
+        return click.style(text, **styles) if self.color else text
+
+    def echo(self, message='', nl=True, level='normal', **styles):
+        """Add a message to the buffer.
+
+        Parameters
+        ----------
+        message : string
+            Text to write.
+        nl : bool
+            Add a trailing newline.
+        level : string
+            Lowest output level at which this message is shown.
+        **styles
+            Passed to `click.style`.
+        """
+        if not self._shown(level):
+            return
+
+        if styles:
+            message = self.style(message, **styles)
+
+        self._buffer.append(message + '\n' if nl else message)
+
+    def event(self, kind, **data):
+        """Record a change made to the current file.
+
+        Counted for the summary, and written out in `json` mode.
+        """
+        self._counts[kind] = self._counts.get(kind, 0) + 1
+
+        if self.level == 'json':
+            data = dict(data, event=kind, file=self._filename)
+            self._buffer.append(json.dumps(data, sort_keys=True) + '\n')
+
+    def start(self, filename):
+        """Begin output for a new file."""
+        self._filename = filename
+        self._counts = {}
+
+    def finish(self, status):
+        """Finish the current file and write out everything about it."""
+        if self.level == 'json':
+            self.event('file', status=status)
+
+        elif self.level == 'summary':
+            counts = ", ".join("%i %s" % (n, kind) for kind, n in sorted(self._counts.items()))
+            self._buffer.append("%s: %s%s\n" % (self._filename, status,
+                                                " (%s)" % counts if counts else ""))
+
+        self.flush()
+        self._filename = None
+
+    def flush(self):
+        """Write out anything buffered.
+
+        Call before prompting so that everything up to now is visible.
+        """
+        if self._buffer:
+            if self._status:
+                self._clear_status()
+            click.echo(''.join(self._buffer), nl=False, err=self.err,
+                       color=self.color)
+            self._buffer = []
+
+    def status(self, message):
+        """Show a status line that is updated in place.
+
+        Only shown on a terminal (and not in `json` mode), and removed before
+        anything else is written.
+        """
+        if not self.tty or self.level == 'json':
+            return
+
+        self.flush()
+        click.echo('\r\x1b[K' + message, nl=False, err=self.err)
+        self._status = True
+
+    def end_status(self):
+        """Leave the status line in place and move onto a new line."""
+        if self._status:
+            click.echo(err=self.err)
+            self._status = False
+
+    def _clear_status(self):
+        click.echo('\r\x1b[K', nl=False, err=self.err)
+        self._status = False
+
+
+# The output used throughout py3port. This stays quiet when used as a library,
+# until it is set up from the command line in `main`.
+out = Output(level='quiet')
@@ -6,8 +6,15 @@ from future.builtins.disabled import *  # noqa  pylint: disable=W0401, W0614
 # === End Python 2/3 compatibility
 
 import parso
+import parso.cache
+from parso.utils import split_lines
 import wrapt
 
+try:
+    from parso.file_io import KnownContentFileIO
+except ImportError:  # Older parso
+    KnownContentFileIO = None
+
 
 class ParsoProxy(wrapt.ObjectProxy):
     """A thin wrapper around a parso node.
@@ -38,6 +45,166 @@ class ParsoProxy(wrapt.ObjectProxy):
     def aparent(self, value):
         self._self_aparent = value
 
+
+class Pattern(object):
+    """A declarative description of a parso subtree.
+
+    Parameters
+    ----------
+    type_ : string or list of strings
+        Node types that match.
+    value : string or list of strings, optional
+        Leaf values that match.
+    children : dict, optional
+        Mapping from child index (which may be negative) to the `Pattern`
+        that child must match.
+    num_children : int, optional
+        Exact number of children required.
+    min_children : int, optional
+        Minimum number of children required. Any indices given in `children`
+        are always required to exist.
+    test : function, optional
+        Any further check, called as `test(node)` once the rest of the
+        pattern matches.
+
+    Examples
+    --------
+    A call of a method called `keys`, i.e. a power ending in an attribute
+    access and then a `()` trailer:
+
+    >>> Pattern('power', children={
+    ...     -2: Pattern('trailer', children={0: Op('.'), 1: Pattern('name', 'keys')}),
+    ...     -1: Pattern('trailer', children={0: Op('('), -1: Op(')')})
+    ... })
+    """
+
+    def __init__(self, type_, value=None, children=None, num_children=None,
+                 min_children=0, test=None):
+
+        self.types = list(type_) if isinstance(type_, (list, tuple)) else [type_]
+        self.value = [value] if isinstance(value, str) else value
+        self.children = children or {}
+        self.num_children = num_children
+        self.min_children = max([min_children] +
+                                [i + 1 if i >= 0 else -i for i in self.children])
+        self.test = test
+
+    def compile(self):
+        """Turn the pattern into a function testing if a node matches."""
+
+        types = frozenset(self.types)
+        values = frozenset(self.value) if self.value is not None else None
+        num_children = self.num_children
+        min_children = self.min_children
+        check_children = num_children is not None or min_children > 0
+        child_matchers = [(i, p.compile()) for i, p in sorted(self.children.items())]
+        test = self.test
+
+        def match(node):
+
+            if node.type not in types:
+                return False
+
+            if values is not None and getattr(node, 'value', None) not in values:
+                return False
+
+            if check_children:
+                children = getattr(node, 'children', None)
+
+                if children is None:
+                    return False
+
+                if num_children is not None and len(children) != num_children:
+                    return False
+
+                if len(children) < min_children:
+                    return False
+
+                for i, child_match in child_matchers:
+                    if not child_match(children[i]):
+                        return False
+
+            if test is not None and not test(node):
+                return False
+
+            return True
+
+        return match
+
+
+def Op(value):
+    """A pattern matching an operator leaf."""
+    return Pattern('operator', value)
+
+
+class AnyOf(object):
+    """A pattern matching any of several patterns."""
+
+    def __init__(self, *patterns):
+        self.patterns = patterns
+        self.types = [t for p in patterns for t in p.types]
+
+    def compile(self):
+        matchers = [p.compile() for p in self.patterns]
+
+        def match(node):
+            return any(m(node) for m in matchers)
+
+        return match
+
+
+class PatternSet(object):
+    """A collection of patterns that are tested together.
+
+    The patterns are compiled once into a table indexed by node type, so
+    finding the match for a node only tests those patterns that could apply
+    to it.
+    """
+
+    def __init__(self):
+        self._rules = []
+        self._index = None
+
+    def register(self, pattern, result):
+        """Add a pattern, returning result from `match` if it applies.
+
+        Patterns are tried in the order they were registered.
+        """
+        self._rules.append((pattern, result))
+        self._index = None
+
+    def _build(self):
+        self._index = {}
+        for pattern, result in self._rules:
+            match = pattern.compile()
+            for type_ in pattern.types:
+                self._index.setdefault(type_, []).append((match, result))
+
+    def match(self, node):
+        """The result for the first pattern matching node, or None."""
+        if self._index is None:
+            self._build()
+
+        for match, result in self._index.get(node.type, ()):
+            if match(node):
+                return result
+
+        return None
+
+    def find(self, tree):
+        """Find every node in tree matching a pattern in a single walk.
+
+        Yields
+        ------
+        node, result
+            The matching node and the result registered for its pattern.
+        """
+        for node in pwalk(tree):
+            result = self.match(node)
+            if result is not None:
+                yield node, result
+
+
 def trim_power(node, parent):
     """Remove the last entry from the power. If only one entry remains,
     return only it.
@@ -110,26 +277,13 @@ class FuncCall(AugmentedNode):
             child.aparent = self
 
 
+    pattern = Pattern('power', children={
+        -1: Pattern('trailer', children={0: Op('('), -1: Op(')')})
+    })
+
     @classmethod
     def matches(cls, node):
-
-        if node.type != 'power':
-            return False
-
-        trailer_node = node.children[-1]
-
-        if trailer_node.type != 'trailer':
-            return False
-
-        if (trailer_node.children[0].type != 'operator' or
-                trailer_node.children[0].value != '('):
-            return False
-
-        if (trailer_node.children[-1].type != 'operator' or
-                trailer_node.children[-1].value != ')'):
-            return False
-
-        return True
+        return _augment_patterns.match(node) is cls
 
 
 class Attribute(AugmentedNode):
@@ -147,22 +301,13 @@ class Attribute(AugmentedNode):
         for child in self.achildren:
             child.aparent = self
 
+    pattern = Pattern('power', children={
+        -1: Pattern('trailer', children={0: Op('.')})
+    })
+
     @classmethod
     def matches(cls, node):
-
-        if node.type != 'power':
-            return False
-
-        trailer_node = node.children[-1]
-
-        if trailer_node.type != 'trailer':
-            return False
-
-        if (trailer_node.children[0].type != 'operator' or
-                trailer_node.children[0].value != '.'):
-            return False
-
-        return True
+        return _augment_patterns.match(node) is cls
 
 
 class Subscript(AugmentedNode):
@@ -186,26 +331,13 @@ class Subscript(AugmentedNode):
         for child in self.achildren:
             child.aparent = self
 
+    pattern = Pattern('power', children={
+        -1: Pattern('trailer', children={0: Op('['), -1: Op(']')})
+    })
+
     @classmethod
     def matches(cls, node):
-
-        if node.type != 'power':
-            return False
-
-        trailer_node = node.children[-1]
-
-        if trailer_node.type != 'trailer':
-            return False
-
-        if (trailer_node.children[0].type != 'operator' or
-                trailer_node.children[0].value != '['):
-            return False
-
-        if (trailer_node.children[-1].type != 'operator' or
-                trailer_node.children[-1].value != ']'):
-            return False
-
-        return True
+        return _augment_patterns.match(node) is cls
 
 
 class BinOp(AugmentedNode):
@@ -229,33 +361,27 @@ class BinOp(AugmentedNode):
         for child in self.achildren:
             child.aparent = self
 
-    @classmethod
-    def matches(cls, node):
-
-        # Any parentheses should decay
-        if node.type == 'atom':
-            if len(node.children) != 3:
-                return False
-
-            first = node.children[0]
-            last = node.children[2]
-            if not (first.type == 'operator' and first.value == '(' and
-                    last.type == 'operator' and last.value == ')'):
-                return False
+    _bare = AnyOf(
+        Pattern(['arith_expr', 'term'], min_children=3),
+        Pattern('power', min_children=3, children={1: Op('**')})
+    )
 
-            return cls.matches(node.children[1])
+    # Any parentheses should decay
+    pattern = AnyOf(
+        _bare,
+        Pattern('atom', num_children=3, children={0: Op('('), 1: _bare, 2: Op(')')})
+    )
 
+    @classmethod
+    def matches(cls, node):
+        return _augment_patterns.match(node) is cls
 
-        if node.type not in ['arith_expr', 'term', 'power']:
-            return False
-
-        if len(node.children) < 3:
-            return False
 
-        if node.type == 'power' and (node.children[1].type != 'operator' or node.children[1].value != '**'):
-            return False
+# Patterns for the augmented types, in order of precedence
+_augment_patterns = PatternSet()
+for _type in [FuncCall, Attribute, Subscript, BinOp]:
+    _augment_patterns.register(_type.pattern, _type)
 
-        return True
 
 def augment(tree):
     """An iterator that walks over a parso tree.
@@ -271,13 +397,9 @@ def augment(tree):
         Node from subtree. Order is complicated.
     """
 
-    augtypes = [FuncCall, Attribute, Subscript, BinOp]
-
-    # Walk tree yielding nodes
-
-    for type_ in augtypes:
-        if type_.matches(tree):
-            return type_(tree)
+    type_ = _augment_patterns.match(tree)
+    if type_ is not None:
+        return type_(tree)
 
     proxynode = ParsoProxy(tree)
 
@@ -411,3 +533,91 @@ def is_float_walk(node):
                 return True
 
     return False
+
+
+def _advance(line, column, text):
+    # Position after text starting at (line, column)
+    if '\n' in text or '\r' in text:
+        lines = split_lines(text)
+        return line + len(lines) - 1, len(lines[-1])
+    return line, column + len(text)
+
+
+def reposition(tree):
+    """Recalculate the positions of all leaves after the tree has been edited.
+
+    Changing the values of leaves (or swapping out nodes) leaves the
+    positions of everything after them stale. This fixes them up so they
+    match `tree.get_code()` again, without reparsing.
+    """
+    line, column = 1, 0
+
+    for node in pwalk(tree):
+
+        if hasattr(node, 'children'):
+            continue
+
+        line, column = _advance(line, column, node.prefix)
+        node.line, node.column = line, column
+        line, column = _advance(line, column, node.value)
+
+
+def reparse(tree, code, version='2.7'):
+    """Parse code, reusing the parts of tree that are unchanged.
+
+    Uses the parso diff parser, so only the regions that differ between
+    `tree.get_code()` and code are actually parsed. This is a big saving when
+    only a few lines have been changed.
+
+    This relies on parso internals, so if they are missing, or the diff
+    parser fails or doesn't reproduce code exactly, it falls back to parsing
+    code from scratch.
+
+    Parameters
+    ----------
+    tree : parso module
+        Tree of the old code. It may have been edited, but is reused (and
+        modified) by the new tree, so shouldn't be used afterwards.
+    code : string
+        The new code.
+    version : string
+        Python grammar to use.
+
+    Returns
+    -------
+    new_tree : parso module
+        Tree for code.
+    """
+    grammar = parso.load_grammar(version=version)
+
+    if not (KnownContentFileIO is not None and hasattr(grammar, '_hashed') and
+            hasattr(parso.cache, 'try_to_save_module') and
+            hasattr(parso.cache, 'parser_cache')):
+        return grammar.parse(code)
+
+    try:
+        new_tree = _diff_parse(grammar, tree, code)
+    except Exception:
+        new_tree = None
+
+    if new_tree is None or new_tree.get_code() != code:
+        return grammar.parse(code)
+
+    return new_tree
+
+
+def _diff_parse(grammar, tree, code):
+
+    old_code = tree.get_code()
+    reposition(tree)
+
+    # The diff parser works against the parso cache, so we register the old
+    # tree there under a unique name and remove it when done
+    file_io = KnownContentFileIO('<py3port %i>' % id(tree), old_code)
+    parso.cache.try_to_save_module(grammar._hashed, file_io, tree,
+                                   split_lines(old_code, keepends=True),
+                                   pickling=False)
+    try:
+        return grammar.parse(code, path=file_io.path, diff_cache=True)
+    finally:
+        parso.cache.parser_cache[grammar._hashed].pop(file_io.path, None)
@@ -0,0 +1,155 @@
+# === Start Python 2/3 compatibility
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from future.builtins import *  # noqa  pylint: disable=W0401, W0614
+from future.builtins.disabled import *  # noqa  pylint: disable=W0401, W0614
+# === End Python 2/3 compatibility
+
+import json
+import os
+import time
+
+
+STAGES = ['preprocess', 'futurize', 'postprocess']
+
+
+def _format_time(seconds):
+    seconds = int(round(seconds))
+    return '%i:%02i:%02i' % (seconds // 3600, (seconds // 60) % 60, seconds % 60)
+
+
+class Progress(object):
+    """Keep track of how far through a run we are, and how long is left.
+
+    The time spent waiting for the user to answer prompts is tracked
+    separately from the time py3port itself takes, so the estimate of the
+    time remaining can be split into the two.
+
+    Parameters
+    ----------
+    total : int
+        Number of files to process.
+    snapshot : string, optional
+        File to periodically write the state of the run to as JSON.
+    interval : float
+        Minimum time in seconds between snapshots.
+    """
+
+    def __init__(self, total, snapshot=None, interval=10.0):
+
+        self.total = total
+        self.snapshot = snapshot
+        self.interval = interval
+
+        self.done = 0
+        self.ported = 0
+        self.stage_time = {stage: 0.0 for stage in STAGES}
+
+        self.prompts = 0
+        self.prompt_time = 0.0
+        self._file_prompt_time = 0.0
+
+        self.start_time = time.time()
+        self._last_snapshot = None
+
+    def timed(self, decide):
+        """Wrap an interactive `decide` function to track the prompts."""
+
+        def timed_decide(node, filename, **kwargs):
+            t0 = time.time()
+            try:
+                return decide(node, filename, **kwargs)
+            finally:
+                dt = time.time() - t0
+                self.prompts += 1
+                self.prompt_time += dt
+                self._file_prompt_time += dt
+
+        return timed_decide
+
+    def finish(self, record=None):
+        """Mark a file as done.
+
+        Parameters
+        ----------
+        record : dict, optional
+            The record returned by `main.process`. Not needed if the file was
+            skipped without being looked at.
+        """
+        self.done += 1
+
+        if record is not None and record['status'] == 'ported':
+            self.ported += 1
+
+            for stage in STAGES:
+                t = record['timings'][stage]
+                if stage == 'preprocess':
+                    t -= self._file_prompt_time  # Only count our own time
+                self.stage_time[stage] += t
+
+        self._file_prompt_time = 0.0
+
+    def state(self):
+        """The current state of the run.
+
+        Returns
+        -------
+        state : dict
+            Counts of files and prompts (done and estimated remaining), the
+            files per second through each stage, and the estimated time
+            remaining split into `machine` and `human` (answering prompts).
+        """
+        remaining = self.total - self.done
+        per_file = sum(self.stage_time.values()) / self.ported if self.ported else 0.0
+        prompts_per_file = self.prompts / self.ported if self.ported else 0.0
+        per_prompt = self.prompt_time / self.prompts if self.prompts else 0.0
+
+        prompts_remaining = prompts_per_file * remaining
+        eta_machine = per_file * remaining
+        eta_human = per_prompt * prompts_remaining
+
+        return {
+            'time': time.time(),
+            'elapsed': time.time() - self.start_time,
+            'total': self.total,
+            'done': self.done,
+            'remaining': remaining,
+            'rates': {stage: self.ported / t if t > 0 else None
+                      for stage, t in self.stage_time.items()},
+            'prompts': self.prompts,
+            'prompts_remaining': int(round(prompts_remaining)),
+            'eta': {'machine': eta_machine, 'human': eta_human,
+                    'total': eta_machine + eta_human},
+        }
+
+    def line(self):
+        """A one line summary of the progress."""
+        state = self.state()
+
+        rates = " ".join("%s %s/s" % (stage[:4], "%.1f" % state['rates'][stage]
+                                      if state['rates'][stage] else "-")
+                         for stage in STAGES)
+
+        return ("[%i/%i] %.0f%% | %s | %i prompts, ~%i left | ETA %s + %s prompts" %
+                (state['done'], state['total'],
+                 100.0 * state['done'] / state['total'] if state['total'] else 100.0,
+                 rates, state['prompts'], state['prompts_remaining'],
+                 _format_time(state['eta']['machine']),
+                 _format_time(state['eta']['human'])))
+
+    def write_snapshot(self, force=False):
+        """Write out the state if it's been long enough since the last time."""
+        if self.snapshot is None:
+            return
+
+        now = time.time()
+        if not force and self._last_snapshot is not None and now - self._last_snapshot < self.interval:
+            return
+
+        # Write then move into place, so readers never see a partial file
+        tmpfile = self.snapshot + '.tmp'
+        with open(tmpfile, 'w') as fh:
+            fh.write(json.dumps(self.state(), sort_keys=True) + '\n')
+        os.rename(tmpfile, self.snapshot)
+
+        self._last_snapshot = now
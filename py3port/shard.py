@@ -0,0 +1,160 @@
+# === Start Python 2/3 compatibility
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from future.builtins import *  # noqa  pylint: disable=W0401, W0614
+from future.builtins.disabled import *  # noqa  pylint: disable=W0401, W0614
+# === End Python 2/3 compatibility
+
+import errno
+import glob
+import hashlib
+import json
+import os
+import socket
+import time
+
+
+def parse_shard(text):
+    """Parse a shard specification of the form `K/N`.
+
+    Parameters
+    ----------
+    text : string
+        Shard specification. `K` counts from one.
+
+    Returns
+    -------
+    shard : tuple
+        The `(K, N)` pair.
+    """
+    try:
+        k, n = [int(s) for s in text.split('/')]
+    except ValueError:
+        raise ValueError("Shard must be given as K/N, not %r" % text)
+
+    if not 1 <= k <= n:
+        raise ValueError("Shard index must lie between 1 and %i" % n)
+
+    return k, n
+
+
+def _digest(filename):
+    # Stable identifier for a file which doesn't depend on how it was found
+    name = os.path.normpath(filename).encode('utf-8')
+    return hashlib.sha1(name).hexdigest()
+
+
+def shard_files(files, k, n):
+    """Select the files belonging to shard `k` of `n`.
+
+    The assignment depends only on the (normalised) path of each file, so
+    every node computes the same partition irrespective of the order in which
+    the files were discovered, and adding files doesn't reshuffle existing
+    ones.
+    """
+    return [f for f in files if int(_digest(f), 16) % n == k - 1]
+
+
+def node_name():
+    """A name for this process unique across the nodes sharing a manifest."""
+    return '%s-%i' % (socket.gethostname(), os.getpid())
+
+
+def init_manifest(directory):
+    """Create the layout of a manifest directory if it doesn't exist."""
+    for sub in ['locks', 'records']:
+        try:
+            os.makedirs(os.path.join(directory, sub))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+
+def claim(directory, filename, node):
+    """Try to take ownership of a file.
+
+    Uses the exclusive creation of a lock file in the manifest so that only a
+    single node processes each file. Locks are kept once a file is done, and
+    only removed by `release` if processing it fails, so a node that is
+    killed outright leaves its lock behind to be deleted by hand.
+
+    Returns
+    -------
+    claimed : bool
+        True if this node now owns the file.
+    """
+    lockfile = os.path.join(directory, 'locks', _digest(filename) + '.lock')
+
+    try:
+        fd = os.open(lockfile, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except OSError as e:
+        if e.errno == errno.EEXIST:
+            return False
+        raise
+
+    with os.fdopen(fd, 'w') as fh:
+        fh.write('%s %s\n' % (node, os.path.normpath(filename)))
+
+    return True
+
+
+def release(directory, filename):
+    """Give up ownership of a file, so it can be claimed again."""
+    lockfile = os.path.join(directory, 'locks', _digest(filename) + '.lock')
+
+    try:
+        os.remove(lockfile)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def write_record(directory, node, record):
+    """Append the record for a processed file to this node's log."""
+    record = dict(record, node=node, time=time.time())
+    recfile = os.path.join(directory, 'records', node + '.jsonl')
+
+    with open(recfile, 'a') as fh:
+        fh.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+def merge_records(directory):
+    """Combine the logs of every node into `merged.jsonl`.
+
+    A file may have several records if it failed and was retried. Only the
+    successful one, or otherwise the latest, is kept.
+
+    Returns
+    -------
+    summary : dict
+        Mapping from node name to a dict with the number of files it handled,
+        the total time it spent on each stage, and the files that `failed`
+        (with their errors).
+    """
+    records = []
+    for recfile in sorted(glob.glob(os.path.join(directory, 'records', '*.jsonl'))):
+        with open(recfile, 'r') as fh:
+            records += [json.loads(line) for line in fh if line.strip()]
+
+    latest = {}
+    for record in sorted(records, key=lambda r: r.get('time', 0.0)):
+        kept = latest.get(record['file'])
+        if kept is None or kept['status'] != 'ported' or record['status'] == 'ported':
+            latest[record['file']] = record
+    records = sorted(latest.values(), key=lambda r: r['file'])
+
+    with open(os.path.join(directory, 'merged.jsonl'), 'w') as fh:
+        for record in records:
+            fh.write(json.dumps(record, sort_keys=True) + '\n')
+
+    summary = {}
+    for record in records:
+        entry = summary.setdefault(record['node'], {'files': 0, 'timings': {}, 'failed': []})
+        if record['status'] == 'failed':
+            entry['failed'].append((record['file'], record.get('error')))
+            continue
+        entry['files'] += 1
+        for stage, t in record['timings'].items():
+            entry['timings'][stage] = entry['timings'].get(stage, 0.0) + t
+
+    return summary
@@ -0,0 +1,217 @@
+# === Start Python 2/3 compatibility
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from future.builtins import *  # noqa  pylint: disable=W0401, W0614
+from future.builtins.disabled import *  # noqa  pylint: disable=W0401, W0614
+# === End Python 2/3 compatibility
+
+import os
+import subprocess
+import tempfile
+
+import parso
+
+from . import parso_util
+from .output import out
+
+
+def module_name(filename, root='.'):
+    """The dotted module name of filename when imported from root."""
+    rel = os.path.relpath(filename, root)
+    parts = os.path.splitext(rel)[0].split(os.sep)
+
+    if parts[-1] == '__init__':
+        parts = parts[:-1]
+
+    return '.'.join(parts)
+
+
+def is_executable(name):
+    """Return True if name is an executable, either as a path or on the PATH."""
+    if os.path.dirname(name):
+        return os.path.isfile(name) and os.access(name, os.X_OK)
+
+    return any(is_executable(os.path.join(d, name))
+               for d in os.environ.get('PATH', '').split(os.pathsep) if d)
+
+
+def is_test(filename):
+    """Return True if filename looks like a test module."""
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return name.startswith('test_') or name.endswith('_test')
+
+
+class ImportGraph(object):
+    """Which of a set of modules import each other.
+
+    Parameters
+    ----------
+    files : list of strings
+        Python files to include in the graph.
+    root : string
+        Directory from which modules are imported.
+    """
+
+    def __init__(self, files, root='.'):
+
+        self.root = root
+        self.modules = {module_name(f, root): f for f in files}
+
+        # Map from a module to those modules that import it
+        self.importers = {mod: set() for mod in self.modules}
+
+        for mod, filename in self.modules.items():
+            for dep in self._dependencies(mod, filename):
+                self.importers[dep].add(mod)
+
+    def _resolve(self, path):
+        # Find the module that an import path refers to, and all the packages
+        # that importing it would also execute
+        found = set()
+        for i in range(1, len(path) + 1):
+            name = '.'.join(path[:i])
+            if name in self.modules:
+                found.add(name)
+        return found
+
+    def _dependencies(self, mod, filename):
+
+        with open(filename, 'r') as fh:
+            tree = parso.parse(fh.read(), version='2.7')
+
+        is_package = os.path.basename(filename) == '__init__.py'
+        package = mod.split('.') if is_package else mod.split('.')[:-1]
+
+        deps = set()
+
+        for node in parso_util.pwalk(tree):
+            if node.type not in ['import_name', 'import_from']:
+                continue
+
+            for path in node.get_paths():
+                path = [name.value for name in path]
+
+                if node.level:
+                    base = package[:len(package) - node.level + 1]
+                    deps |= self._resolve(base + path)
+                else:
+                    # Python 2 also tries the import relative to the package
+                    deps |= self._resolve(path)
+                    deps |= self._resolve(package + path)
+
+        deps.discard(mod)
+        return deps
+
+    def affected_tests(self, filename):
+        """Find the test modules that transitively import filename.
+
+        Returns
+        -------
+        tests : list of strings
+            Sorted filenames of the tests. Includes filename if it is a test.
+        """
+        start = module_name(filename, self.root)
+        if start not in self.modules:
+            return []
+
+        seen = {start}
+        stack = [start]
+
+        while stack:
+            for importer in self.importers[stack.pop()]:
+                if importer not in seen:
+                    seen.add(importer)
+                    stack.append(importer)
+
+        return sorted(self.modules[mod] for mod in seen if is_test(self.modules[mod]))
+
+
+class TestRunner(object):
+    """Run tests in the background, reporting the outcome as they finish.
+
+    Parameters
+    ----------
+    interpreters : list of strings
+        Python executables to run each set of tests with (via pytest).
+    jobs : int
+        Maximum number of test runs going at once.
+    root : string
+        Directory to run the tests from.
+    """
+
+    def __init__(self, interpreters, jobs=1, root='.'):
+
+        self.interpreters = interpreters
+        self.jobs = jobs
+        self.root = root
+
+        self._pending = []
+        self._running = []
+
+    def submit(self, filename, tests):
+        """Queue up the tests affected by porting filename."""
+        if not tests:
+            return
+
+        for interp in self.interpreters:
+            self._pending.append((filename, interp, tests))
+
+    def _start(self, filename, interp, tests):
+        output = tempfile.TemporaryFile()
+
+        # Keep the tests away from the terminal, which we use for prompts
+        try:
+            with open(os.devnull, 'rb') as devnull:
+                proc = subprocess.Popen([interp, '-m', 'pytest', '-q'] + tests,
+                                        stdin=devnull, stdout=output,
+                                        stderr=subprocess.STDOUT, cwd=self.root)
+        except OSError as e:
+            output.close()
+            out.event('tests', tested=filename, interpreter=interp, passed=False)
+            out.echo("Could not run tests for %s under %s: %s" % (filename, interp, e),
+                     level='quiet', fg='red', bold=True)
+            out.flush()
+            return
+
+        self._running.append((proc, output, filename, interp, tests))
+
+    def poll(self):
+        """Report any finished test runs and start queued ones."""
+
+        still_running = []
+
+        for job in self._running:
+            if job[0].poll() is None:
+                still_running.append(job)
+            else:
+                self._report(*job)
+
+        self._running = still_running
+
+        while self._pending and len(self._running) < self.jobs:
+            self._start(*self._pending.pop(0))
+
+    def wait(self):
+        """Wait for all queued tests to finish."""
+        self.poll()
+        while self._running:
+            self._running[0][0].wait()
+            self.poll()
+
+    def _report(self, proc, output, filename, interp, tests):
+
+        out.event('tests', tested=filename, interpreter=interp,
+                  passed=proc.returncode == 0)
+
+        if proc.returncode == 0:
+            out.echo("Tests for %s passed under %s (%i modules)" %
+                     (filename, interp, len(tests)), fg='green')
+        else:
+            output.seek(0)
+            log = output.read().decode('utf-8', 'replace')
+            out.echo("Tests for %s FAILED under %s:" % (filename, interp),
+                     level='quiet', fg='red', bold=True)
+            out.echo(log, level='summary')
+
+        output.close()
+        out.flush()